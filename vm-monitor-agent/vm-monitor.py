@@ -8,13 +8,20 @@ Now includes API key authentication for secure webhook communication.
 """
 
 import os
-import json
 import time
+import asyncio
+import hashlib
+import collections
+import random
 import logging
 import datetime
-import requests
+import httpx
+import orjson
+import signal
 import socket
 import argparse
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
 from datetime import datetime, timezone
 import sys
 
@@ -32,23 +39,110 @@ SCHEDULED_EVENTS_URL = "http://169.254.169.254/metadata/scheduledevents?api-vers
 INSTANCE_INFO_URL = f"{METADATA_URL}?api-version=2021-02-01"
 WEBHOOK_URL = "https://azure-vm-manager.mastercraftapps.workers.dev/webhook"
 CHECK_INTERVAL = 5  # seconds
+IDLE_CHECK_INTERVAL = 15  # relaxed interval once no events have been seen for a while
+IDLE_POLLS_BEFORE_SLOWDOWN = 60  # idle polls before switching to IDLE_CHECK_INTERVAL
+URGENT_WINDOW = 30  # seconds around an event's NotBefore time during which polling speeds up
 METADATA_TIMEOUT = 3  # shorter timeout (seconds)
+METADATA_RETRIES = 5  # attempts to read VM identity from IMDS on startup
+PROBE_TIMEOUT = 2  # timeout for the optional startup webhook probe (seconds)
 HEARTBEAT_INTERVAL = 300  # log a heartbeat every 5 minutes
 MAX_CONSECUTIVE_ERRORS = 10  # maximum number of errors before backing off
+MAX_PROCESSED_EVENTS = 256  # number of handled event IDs remembered to avoid duplicate notifications
+MAX_PROCESSED_BODIES = 64  # number of fully handled scheduled events bodies remembered
+WEBHOOK_QUEUE_SIZE = 8  # pending webhook notifications before the oldest is dropped
+MAX_LOGGED_RESPONSE = 512  # characters of a webhook response body written to the log
 
 # Default resource group fallback (only used if metadata fails completely)
 DEFAULT_RESOURCE_GROUP = "test"
 
+# Hostname fallback for the VM name; stable for the life of the VM
+_HOSTNAME = socket.gethostname()
+
 # API Key for webhook authentication - should be set as environment variable
 WEBHOOK_API_KEY = os.getenv('WEBHOOK_API_KEY')
 
-def get_azure_metadata():
+# Static request headers, built once rather than on every poll.
+# Webhook headers depend on the API key and are filled in by main() once it is resolved
+_IMDS_HEADERS = {"Metadata": "true"}
+_WEBHOOK_HEADERS = None
+
+# Persistent HTTP clients so connections are reused between polls
+# instead of paying a fresh TCP (and, for the webhook, TLS) handshake each time.
+# Created by main() once the webhook headers are known, see create_clients()
+_imds_client = None
+_webhook_client = None
+
+def create_clients():
+    """Create the shared IMDS and webhook HTTP clients."""
+    global _imds_client, _webhook_client
+    # IMDS only speaks HTTP/1.1 and must never be reached through a proxy
+    _imds_client = httpx.AsyncClient(
+        headers=_IMDS_HEADERS,
+        timeout=METADATA_TIMEOUT,
+        limits=httpx.Limits(max_connections=4, max_keepalive_connections=2, keepalive_expiry=75),
+        trust_env=False
+    )
+    # The webhook Worker speaks HTTP/2, so heartbeats and eviction notices share one connection
+    _webhook_client = httpx.AsyncClient(
+        http2=True,
+        headers=_WEBHOOK_HEADERS,
+        timeout=5.0,
+        limits=httpx.Limits(max_connections=2, max_keepalive_connections=2)
+    )
+
+# Set to force an immediate recheck; _shutdown additionally stops all loops.
+# Created inside the running event loop, see main()
+_wake = None
+_shutdown = None
+
+def request_shutdown():
+    """Signal handler: stop the monitor loops and wake them immediately."""
+    logger.info("Shutdown requested")
+    _shutdown.set()
+    _wake.set()
+
+def request_recheck():
+    """Signal handler: poll scheduled events now instead of waiting for the interval."""
+    logger.info("Recheck requested")
+    _wake.set()
+
+def install_signal_handlers():
+    """Wire SIGTERM/SIGINT to a clean shutdown and SIGUSR1 to an immediate recheck."""
+    loop = asyncio.get_running_loop()
+    handlers = [(signal.SIGTERM, request_shutdown), (signal.SIGINT, request_shutdown)]
+    if hasattr(signal, "SIGUSR1"):
+        handlers.append((signal.SIGUSR1, request_recheck))
+    for sig, handler in handlers:
+        try:
+            loop.add_signal_handler(sig, handler)
+        except (NotImplementedError, RuntimeError):
+            # Not supported on Windows event loops - fall back to KeyboardInterrupt
+            pass
+
+async def wait_for_wake(timeout):
+    """Sleep for up to timeout seconds, returning early if a recheck or shutdown is requested."""
+    try:
+        await asyncio.wait_for(_wake.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    _wake.clear()
+
+async def close_clients():
+    """Close the shared HTTP clients."""
+    for client in (_imds_client, _webhook_client):
+        if client is not None:
+            await client.aclose()
+
+async def _imds_get(url):
+    """GET an IMDS endpoint and return the raw response body; request errors are raised."""
+    response = await _imds_client.get(url)
+    response.raise_for_status()
+    return response.content
+
+async def get_azure_metadata():
     """Retrieve Azure VM metadata including resourceGroup and vmName."""
     try:
-        headers = {"Metadata": "true"}
-        response = requests.get(INSTANCE_INFO_URL, headers=headers, timeout=METADATA_TIMEOUT)
-        response.raise_for_status()
-        metadata = response.json()
+        metadata = orjson.loads(await _imds_get(INSTANCE_INFO_URL))
         
         vm_name = metadata.get("compute", {}).get("name")
         resource_group = metadata.get("compute", {}).get("resourceGroupName")
@@ -58,48 +152,100 @@ def get_azure_metadata():
             return None, None
             
         # Log what we found in metadata
-        logger.info(f"Metadata reports resource group as: {resource_group}")
+        logger.debug("Metadata reports resource group as: %s", resource_group)
         
         # Return exactly as received from metadata (preserving case)
         return resource_group, vm_name
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error retrieving Azure metadata: {e}")
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        logger.error("Error retrieving Azure metadata: %s", e)
         return None, None
 
-def check_scheduled_events():
-    """Check for scheduled maintenance events on the VM."""
-    try:
-        headers = {"Metadata": "true"}
-        response = requests.get(SCHEDULED_EVENTS_URL, headers=headers, timeout=METADATA_TIMEOUT)
-        response.raise_for_status()
-        events_data = response.json()
-        
-        if not events_data or "Events" not in events_data:
-            return None
-            
-        events = events_data.get("Events", [])
-        
-        # Filter for preempt events (spot VM eviction) or other termination events
-        termination_events = [
-            event for event in events
-            if event.get("EventType") in ["Preempt", "Terminate", "Reboot", "Redeploy"]
-        ]
-        
-        if termination_events:
-            return termination_events[0]  # Return the first termination event
+# (resource_group, vm_name) for this VM, resolved once by resolve_identity()
+_identity = None
+
+async def resolve_identity():
+    """Resolve the VM's resource group and name, falling back to defaults if IMDS is unavailable.
+    The identity never changes for the life of the VM, so it is only looked up once per process.
+    """
+    global _identity
+    if _identity is not None:
+        return _identity
+    
+    resource_group, vm_name = None, None
+    for attempt in range(METADATA_RETRIES):
+        resource_group, vm_name = await get_azure_metadata()
+        if resource_group and vm_name:
+            break
+        if attempt < METADATA_RETRIES - 1:
+            await asyncio.sleep(0.5 * (2 ** attempt) + random.random() * 0.25)
+    else:
+        logger.warning("Failed to get metadata after %d attempts", METADATA_RETRIES)
+    
+    # Fallback if metadata service is not available
+    if not vm_name:
+        vm_name = _HOSTNAME
+        logger.warning("Could not get VM name, using hostname: %s", vm_name)
+    
+    if not resource_group:
+        logger.warning("Could not get resource group, using default: %s", DEFAULT_RESOURCE_GROUP)
+        resource_group = DEFAULT_RESOURCE_GROUP
+    
+    _identity = (resource_group, vm_name)
+    return _identity
+
+# Hash of the last scheduled events body and the event parsed from it.
+# IMDS returns the same document on almost every poll, so parsing is skipped when it is unchanged
+_last_body_hash = None
+_last_event = None
+
+# Hashes of scheduled events bodies whose termination event has already been notified
+_processed_body_hashes = collections.OrderedDict()
+
+async def check_scheduled_events():
+    """Check for scheduled maintenance events on the VM.
+    Request errors are raised so the caller can back off during IMDS outages.
+    """
+    global _last_body_hash, _last_event
+    body = await _imds_get(SCHEDULED_EVENTS_URL)
+    
+    body_hash = hashlib.blake2b(body, digest_size=8).digest()
+    if body_hash in _processed_body_hashes:
+        _processed_body_hashes.move_to_end(body_hash)
         return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error checking scheduled events: {e}")
+    if body_hash == _last_body_hash:
+        return _last_event
+    
+    _last_event = parse_scheduled_events(orjson.loads(body))
+    _last_body_hash = body_hash
+    return _last_event
+
+def mark_events_processed():
+    """Remember the last scheduled events body as handled so identical responses are skipped entirely."""
+    _processed_body_hashes[_last_body_hash] = True
+    if len(_processed_body_hashes) > MAX_PROCESSED_BODIES:
+        _processed_body_hashes.popitem(last=False)
+
+def parse_scheduled_events(events_data):
+    """Return the first termination event from a scheduled events document, if any."""
+    if not events_data or "Events" not in events_data:
         return None
+        
+    events = events_data.get("Events", [])
+    
+    # Filter for preempt events (spot VM eviction) or other termination events
+    termination_events = [
+        event for event in events
+        if event.get("EventType") in ["Preempt", "Terminate", "Reboot", "Redeploy"]
+    ]
+    
+    if termination_events:
+        return termination_events[0]  # Return the first termination event
+    return None
 
-def send_webhook(resource_group, vm_name, event_type=None, event_time=None):
+async def send_webhook(resource_group, vm_name, event_type=None, event_time=None):
     """Send webhook notification with VM information.
-    Now includes API key authentication.
+    Authentication comes from the webhook client headers; main() guarantees an API key is set.
     """
-    if not WEBHOOK_API_KEY:
-        logger.error("WEBHOOK_API_KEY environment variable not set - cannot authenticate with webhook")
-        return False
-    
     # Simplified payload with just resource group and VM name
     # Using exact case as received from metadata
     payload = {
@@ -107,162 +253,293 @@ def send_webhook(resource_group, vm_name, event_type=None, event_time=None):
         "vmName": vm_name
     }
     
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {WEBHOOK_API_KEY}"
-    }
-    
     try:
-        logger.info(f"Sending webhook notification: {payload}")
-        response = requests.post(WEBHOOK_URL, headers=headers, json=payload, timeout=5)
-        
+        logger.info("Sending webhook notification: %s", payload)
+        response = await _webhook_client.post(WEBHOOK_URL, content=orjson.dumps(payload))
         if response.status_code == 401:
             logger.error("Webhook authentication failed - check WEBHOOK_API_KEY")
             return False
         elif response.status_code == 400:
-            logger.error(f"Bad request to webhook: {response.text}")
+            logger.error("Bad request to webhook: %s", response.text[:MAX_LOGGED_RESPONSE])
             return False
         
         response.raise_for_status()
-        logger.info(f"Webhook sent successfully: {response.status_code}")
+        logger.info("Webhook sent successfully: %s (%s)", response.status_code, response.http_version)
         
-        # Log the response for debugging
+        # Log the response for debugging, only decoding it when the server says it is JSON
+        body = response.content
+        content_type = response.headers.get("Content-Type", "")
         try:
-            response_data = response.json()
-            logger.info(f"Webhook response: {response_data}")
-        except:
-            logger.info(f"Webhook response (non-JSON): {response.text}")
+            if "application/json" in content_type:
+                logger.info("Webhook response: %s", orjson.loads(body))
+            else:
+                logger.info("Webhook response (non-JSON): %s", body[:MAX_LOGGED_RESPONSE].decode(errors='replace'))
+        except orjson.JSONDecodeError:
+            logger.info("Webhook response (invalid JSON): %s", body[:MAX_LOGGED_RESPONSE].decode(errors='replace'))
         
         return True
         
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error sending webhook: {e}")
+    except httpx.HTTPError as e:
+        logger.error("Error sending webhook: %s", e)
         return False
 
-def main():
-    """Main function to periodically check for VM termination events."""
-    parser = argparse.ArgumentParser(description='Monitor Azure Spot VM for eviction notices.')
-    parser.add_argument('--webhook', type=str, help='Custom webhook URL (optional)')
-    parser.add_argument('--interval', type=int, default=CHECK_INTERVAL, 
-                        help=f'Check interval in seconds (default: {CHECK_INTERVAL})')
-    parser.add_argument('--heartbeat', type=int, default=HEARTBEAT_INTERVAL,
-                        help=f'Heartbeat interval in seconds (default: {HEARTBEAT_INTERVAL})')
-    parser.add_argument('--api-key', type=str, help='Webhook API key (can also use WEBHOOK_API_KEY env var)')
-    args = parser.parse_args()
-    
-    # Update constants if provided via arguments
-    global WEBHOOK_URL, WEBHOOK_API_KEY
-    if args.webhook:
-        WEBHOOK_URL = args.webhook
-    if args.api_key:
-        WEBHOOK_API_KEY = args.api_key
-    
-    # Validate API key is available
-    if not WEBHOOK_API_KEY:
-        logger.error("No API key provided. Set WEBHOOK_API_KEY environment variable or use --api-key argument")
-        sys.exit(1)
-    
-    check_interval = args.interval or CHECK_INTERVAL
-    heartbeat_interval = args.heartbeat or HEARTBEAT_INTERVAL
-    
-    # Get VM information - more resilient with retries
-    resource_group, vm_name = None, None
-    retry_count = 0
-    max_retries = 5
-    
-    while (not resource_group or not vm_name) and retry_count < max_retries:
-        resource_group, vm_name = get_azure_metadata()
-        if not resource_group or not vm_name:
-            retry_count += 1
-            logger.warning(f"Failed to get metadata, retry {retry_count}/{max_retries}")
-            time.sleep(2)  # Short pause between retries
-    
-    # Fallback if metadata service is not available
-    if not vm_name:
-        hostname = socket.gethostname()
-        logger.warning(f"Could not get VM name, using hostname: {hostname}")
-        vm_name = hostname
-    
-    if not resource_group:
-        logger.warning(f"Could not get resource group, using default: {DEFAULT_RESOURCE_GROUP}")
-        resource_group = DEFAULT_RESOURCE_GROUP
-    
-    logger.info(f"Monitoring VM: {vm_name} in resource group: {resource_group}")
-    logger.info(f"Webhook URL: {WEBHOOK_URL}")
-    logger.info(f"Check interval: {check_interval} seconds")
-    logger.info(f"Heartbeat interval: {heartbeat_interval} seconds")
-    logger.info(f"API key configured: {'Yes' if WEBHOOK_API_KEY else 'No'}")
-    
-    # Test webhook connectivity on startup
-    logger.info("Testing webhook connectivity...")
-    if send_webhook(resource_group, vm_name):
-        logger.info("Webhook connectivity test successful")
-    else:
-        logger.warning("Webhook connectivity test failed - continuing anyway")
-    
+# A queued webhook notification; result is a future resolved with whether it was delivered
+Notification = collections.namedtuple("Notification", ["event_type", "event_time", "result"])
+
+# Pending notifications drained by flush_webhooks(). Created inside the running event loop, see main()
+_pending = None
+
+def queue_webhook(event_type=None, event_time=None):
+    """Queue a webhook notification and return a future resolving to whether it was sent.
+    When the queue is full the oldest notification is dropped and reported as not sent.
+    """
+    result = asyncio.get_running_loop().create_future()
+    if _pending.full():
+        stale = _pending.get_nowait()
+        stale.result.set_result(False)
+        logger.warning("Webhook queue full, dropped oldest pending notification")
+    _pending.put_nowait(Notification(event_type, event_time, result))
+    return result
+
+async def flush_webhooks(resource_group, vm_name):
+    """Drain queued notifications, coalescing everything pending into a single webhook.
+    Termination events take precedence over heartbeats; otherwise the newest notification wins.
+    """
+    while True:
+        batch = [await _pending.get()]
+        while not _pending.empty():
+            batch.append(_pending.get_nowait())
+        
+        notification = next((n for n in reversed(batch) if n.event_type), batch[-1])
+        if len(batch) > 1:
+            logger.info("Coalesced %d pending notifications into one webhook", len(batch))
+        
+        try:
+            success = await send_webhook(resource_group, vm_name, notification.event_type, notification.event_time)
+        except Exception as e:
+            logger.error("Error sending webhook: %s", e)
+            success = False
+        
+        for n in batch:
+            if not n.result.done():
+                n.result.set_result(success)
+
+async def check_webhook_dns():
+    """Resolve the webhook host locally without sending any traffic to the webhook."""
+    parts = urlsplit(WEBHOOK_URL)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    try:
+        await asyncio.get_running_loop().getaddrinfo(parts.hostname, port)
+        logger.info("Webhook host %s resolved successfully", parts.hostname)
+        return True
+    except OSError as e:
+        logger.warning("Could not resolve webhook host %s: %s", parts.hostname, e)
+        return False
+
+async def probe_webhook():
+    """Send a HEAD request to the webhook URL and log the returned status."""
+    try:
+        response = await _webhook_client.head(WEBHOOK_URL, timeout=PROBE_TIMEOUT)
+        logger.info("Webhook probe returned status: %s", response.status_code)
+    except httpx.HTTPError as e:
+        logger.warning("Webhook probe failed - continuing anyway: %s", e)
+
+def parse_not_before(value):
+    """Parse an event's NotBefore time into an aware datetime, or None if missing or invalid.
+    IMDS uses RFC 1123 dates (e.g. "Mon, 19 Sep 2016 18:29:47 GMT"); ISO 8601 is accepted too.
+    """
+    if not value:
+        return None
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            when = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when
+
+def poll_interval(check_interval, idle_polls, not_before):
+    """Pick the delay before the next scheduled events poll.
+    Polls faster within URGENT_WINDOW of a known NotBefore and slower after a long idle stretch.
+    NotBefore is a wall-clock time, so only this comparison uses the system clock;
+    the returned delay itself is waited on the event loop's monotonic clock.
+    """
+    if not_before is not None:
+        seconds_until_event = (not_before - datetime.now(timezone.utc)).total_seconds()
+        if seconds_until_event <= URGENT_WINDOW:
+            return max(1, check_interval // 5)
+    if idle_polls >= IDLE_POLLS_BEFORE_SLOWDOWN:
+        return max(check_interval, IDLE_CHECK_INTERVAL)
+    return check_interval
+
+async def poll_events(resource_group, vm_name, check_interval):
+    """Poll the scheduled events endpoint and notify on termination events."""
     # Keep track of events we've already processed
-    processed_events = set()
+    processed_events = collections.OrderedDict()
     
-    # Track errors and last heartbeat
+    # Track consecutive errors and polls without any event
     consecutive_errors = 0
-    last_heartbeat_time = time.time()
+    idle_polls = 0
     
-    # Main monitoring loop
-    while True:
-        current_time = time.time()
-        
+    # NotBefore time of the most recent termination event, used to speed up polling near it
+    not_before = None
+    
+    # Random start offset so VMs booted together don't poll and notify in lockstep
+    await wait_for_wake(random.uniform(0, check_interval))
+    
+    while not _shutdown.is_set():
         try:
             # Check for scheduled events
-            event = check_scheduled_events()
+            event = await check_scheduled_events()
             
-            # Reset error counter on success
+            # Reset error counter only after a successful call
             consecutive_errors = 0
             
+            # Relax the interval during steady state, snap back as soon as an event appears
+            idle_polls = 0 if event else idle_polls + 1
+            
+            if event:
+                not_before = parse_not_before(event.get("NotBefore")) or not_before
+            elif not_before is not None and (datetime.now(timezone.utc) - not_before).total_seconds() > URGENT_WINDOW:
+                not_before = None
+            
             if event and event.get("EventId") not in processed_events:
                 event_id = event.get("EventId")
                 event_type = event.get("EventType")
                 event_time = event.get("NotBefore", datetime.now(timezone.utc).isoformat())
                 
-                logger.warning(f"VM termination event detected: {event_type}, scheduled for: {event_time}")
+                logger.warning("VM termination event detected: %s, scheduled for: %s", event_type, event_time)
                 
                 # Send webhook notification
-                success = send_webhook(resource_group, vm_name, event_type, event_time)
+                success = await queue_webhook(event_type, event_time)
                 
                 if success:
                     # Add to processed events to avoid duplicate notifications
-                    processed_events.add(event_id)
-                    logger.info(f"Processed event {event_id}")
+                    processed_events[event_id] = True
+                    if len(processed_events) > MAX_PROCESSED_EVENTS:
+                        processed_events.popitem(last=False)
+                    mark_events_processed()
+                    logger.info("Processed event %s", event_id)
                 else:
                     # If webhook fails, we'll try again on the next iteration
                     logger.warning("Webhook failed, will retry on next check")
-            
-            # Send heartbeat notification periodically
-            if current_time - last_heartbeat_time >= heartbeat_interval:
-                logger.info("Sending heartbeat notification")
-                send_webhook(resource_group, vm_name)
-                last_heartbeat_time = current_time
                 
         except Exception as e:
             consecutive_errors += 1
-            logger.error(f"Error in main loop (attempt {consecutive_errors}): {e}")
+            logger.error("Error in main loop (attempt %d): %s: %s", consecutive_errors, type(e).__name__, e)
             
-            # If too many consecutive errors, back off check interval
+            # If too many consecutive errors, back off exponentially with full jitter
             if consecutive_errors > MAX_CONSECUTIVE_ERRORS:
-                backoff_interval = min(300, check_interval * 2)  # Max 5 minute backoff
-                logger.warning(f"Too many consecutive errors, backing off to {backoff_interval}s")
-                time.sleep(backoff_interval)
-                # Reset error counter after backoff
-                consecutive_errors = MAX_CONSECUTIVE_ERRORS // 2
+                exponent = min(consecutive_errors - MAX_CONSECUTIVE_ERRORS, 6)
+                backoff_interval = min(300, check_interval * (2 ** exponent))  # Max 5 minute backoff
+                delay = random.uniform(0, backoff_interval)
+                logger.warning("Too many consecutive errors, backing off for %.1fs (up to %ss)", delay, backoff_interval)
+                await wait_for_wake(delay)
             
-        # Sleep before next check
-        time.sleep(check_interval)
+        # Sleep before next check, waking early on recheck or shutdown
+        await wait_for_wake(poll_interval(check_interval, idle_polls, not_before))
+
+async def heartbeat(resource_group, vm_name, heartbeat_interval):
+    """Send a heartbeat notification periodically, independent of event polling."""
+    # Interval bookkeeping uses the monotonic clock so wall-clock jumps
+    # (e.g. NTP sync at VM start) can neither burst nor suppress heartbeats
+    last_heartbeat_time = time.monotonic()
+    while not _shutdown.is_set():
+        try:
+            remaining = heartbeat_interval - (time.monotonic() - last_heartbeat_time)
+            await asyncio.wait_for(_shutdown.wait(), timeout=max(0, remaining))
+            break
+        except asyncio.TimeoutError:
+            pass
+        logger.info("Sending heartbeat notification")
+        queue_webhook()
+        last_heartbeat_time = time.monotonic()
+
+async def main():
+    """Main function to periodically check for VM termination events."""
+    parser = argparse.ArgumentParser(description='Monitor Azure Spot VM for eviction notices.')
+    parser.add_argument('--webhook', type=str, help='Custom webhook URL (optional)')
+    parser.add_argument('--interval', type=int, default=CHECK_INTERVAL, 
+                        help=f'Check interval in seconds (default: {CHECK_INTERVAL})')
+    parser.add_argument('--heartbeat', type=int, default=HEARTBEAT_INTERVAL,
+                        help=f'Heartbeat interval in seconds (default: {HEARTBEAT_INTERVAL})')
+    parser.add_argument('--api-key', type=str, help='Webhook API key (can also use WEBHOOK_API_KEY env var)')
+    parser.add_argument('--probe', action='store_true',
+                        help='Probe the webhook URL with a HEAD request on startup (default: DNS check only)')
+    args = parser.parse_args()
+    
+    # Update constants if provided via arguments
+    global WEBHOOK_URL, WEBHOOK_API_KEY
+    if args.webhook:
+        WEBHOOK_URL = args.webhook
+    if args.api_key:
+        WEBHOOK_API_KEY = args.api_key
+    
+    # Validate API key is available
+    if not WEBHOOK_API_KEY:
+        logger.error("No API key provided. Set WEBHOOK_API_KEY environment variable or use --api-key argument")
+        sys.exit(1)
+    
+    global _WEBHOOK_HEADERS
+    _WEBHOOK_HEADERS = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {WEBHOOK_API_KEY}"
+    }
+    
+    check_interval = args.interval or CHECK_INTERVAL
+    heartbeat_interval = args.heartbeat or HEARTBEAT_INTERVAL
+    
+    global _wake, _shutdown, _pending
+    _wake = asyncio.Event()
+    _shutdown = asyncio.Event()
+    _pending = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+    install_signal_handlers()
+    
+    create_clients()
+    try:
+        # Get VM information - retried with backoff, then cached for the process
+        resource_group, vm_name = await resolve_identity()
+        
+        logger.info("Monitoring VM: %s in resource group: %s", vm_name, resource_group)
+        logger.info("Webhook URL: %s", WEBHOOK_URL)
+        logger.info("Check interval: %s seconds (%ss after %d idle polls)",
+                    check_interval, max(check_interval, IDLE_CHECK_INTERVAL), IDLE_POLLS_BEFORE_SLOWDOWN)
+        logger.info("Heartbeat interval: %s seconds", heartbeat_interval)
+        logger.info("API key configured: %s", 'Yes' if WEBHOOK_API_KEY else 'No')
+        
+        # Cheap local connectivity check on startup; only touch the webhook when asked to,
+        # so a fleet booting at once doesn't flood it
+        await check_webhook_dns()
+        if args.probe:
+            await probe_webhook()
+        
+        # Event polling and heartbeats run concurrently on one event loop,
+        # with all webhook traffic funnelled through a single background flusher
+        flusher = asyncio.ensure_future(flush_webhooks(resource_group, vm_name))
+        try:
+            await asyncio.gather(
+                poll_events(resource_group, vm_name, check_interval),
+                heartbeat(resource_group, vm_name, heartbeat_interval)
+            )
+        finally:
+            flusher.cancel()
+            try:
+                await flusher
+            except asyncio.CancelledError:
+                pass
+    finally:
+        await close_clients()
+        logger.info("Monitor stopped")
 
 if __name__ == "__main__":
     try:
         logger.info("Starting Azure Spot VM Monitor")
-        main()
+        asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Monitor stopped by user")
     except Exception as e:
-        logger.critical(f"Fatal error: {e}")
-        sys.exit(1)
\ No newline at end of file
+        logger.critical("Fatal error: %s", e)
+        sys.exit(1)